@@ -3,17 +3,25 @@
 DDC Monitor Input Switcher with USB Switch Control
 Listens for macro pad button presses and switches monitor inputs via DDC commands
 Also controls USB switch via GPIO optocouplers
-Simple version: Always wakes monitor before switching (F23/F24 only)
+Wakes the monitor before switching by default (--no-wake-before-switch to skip)
+and can read the input back after each switch (--verify)
 """
 
+import argparse
+import asyncio
 import evdev
-import subprocess
-import time
+import pyudev
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+import re
 from pathlib import Path
 import RPi.GPIO as GPIO
 import atexit
+import errno
+import fcntl
+import os
+import shutil
 import signal
 import sys
 
@@ -24,26 +32,106 @@ log_handler = RotatingFileHandler(
     backupCount=3,  # Keep 3 backup files
 )
 console_handler = logging.StreamHandler()
+
+# File and console writes happen on a background thread; the event loop
+# only enqueues records
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue, log_handler, console_handler, respect_handler_level=True
+)
+log_listener.start()
+atexit.register(log_listener.stop)
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[log_handler, console_handler],
+    handlers=[QueueHandler(log_queue)],
 )
+logger = logging.getLogger(__name__)
+
+# evdev constants used on every input event, bound once
+EV_KEY = evdev.ecodes.EV_KEY
+KEY_DOWN = evdev.KeyEvent.key_down
+KEY_F22 = evdev.ecodes.KEY_F22
+KEY_F23 = evdev.ecodes.KEY_F23
+KEY_F24 = evdev.ecodes.KEY_F24
 
 
 class DDCMonitorSwitcher:
-    def __init__(self):
+    # Matches the value in `ddcutil getvcp 60` output, either the
+    # non-continuous form "(sl=0x0f)" or "current value = 15"
+    _CUR_RE = re.compile(
+        rb"sl=0x([0-9a-f]+)|current value\s*=\s*(?:0x([0-9a-f]+)|(\d+))", re.I
+    )
+
+    # DDC/CI over /dev/i2c-N (see <linux/i2c-dev.h> and the MCCS spec)
+    I2C_SLAVE = 0x0703  # ioctl to select the slave address
+    DDC_CI_ADDRESS = 0x37  # Monitor's DDC/CI address (0x6E when shifted)
+    DDC_CI_DELAY = 0.05  # Monitors need 50ms between messages
+    DDC_CI_REPLY_DELAY = 0.04  # and up to 40ms to prepare a Get VCP reply
+    DDC_CI_RETRIES = 4  # Monitors may NAK while busy (e.g. waking up)
+    VCP_INPUT_SOURCE = 0x60
+    VCP_POWER_MODE = 0xD6
+    POWER_ON = 0x01
+    POWER_STANDBY = 0x02
+
+    def __init__(self, verify=False, wake_before=True):
         self.bus_number = 2  # Monitor on i2c-2
+        self.verify = verify  # Read the input back after each switch
+        self.VERIFY_DELAY = 1.0  # Give the monitor time to change input first
+        self.wake_before = wake_before  # Send a wake command before switching
+        # Resolve ddcutil once so each command skips the PATH search
+        self.ddcutil = shutil.which("ddcutil") or "ddcutil"
         self.inputs = {
             "displayport": 15,  # VCP code for DisplayPort
             "usbc": 27,  # VCP code for USB-C
             "hdmi": 17,  # VCP code for HDMI
         }
+        self._vcp_to_name = {code: name for name, code in self.inputs.items()}
         self.button_mapping = {
-            evdev.ecodes.KEY_F23: "displayport",  # Button 1 -> DisplayPort + USB Input 1
-            evdev.ecodes.KEY_F24: "usbc",  # Button 2 -> USB-C + USB Input 2
-            evdev.ecodes.KEY_F22: "hdmi_standby",  # Button 3 -> HDMI + Standby (no USB change)
+            KEY_F23: "displayport",  # Button 1 -> DisplayPort + USB Input 1
+            KEY_F24: "usbc",  # Button 2 -> USB-C + USB Input 2
+            KEY_F22: "hdmi_standby",  # Button 3 -> HDMI + Standby (no USB change)
+        }
+
+        # ddcutil command lines never change, so build them once
+        bus_arg = f"--bus={self.bus_number}"
+        self._argv = {
+            name: (self.ddcutil, "setvcp", "60", str(vcp_code), bus_arg)
+            for name, vcp_code in self.inputs.items()
         }
+        self._get_argv = (self.ddcutil, "getvcp", "60", bus_arg)
+        # D6 is the power mode: 01 = On, 02 = Standby
+        self._wake_argv = (self.ddcutil, "setvcp", "D6", "01", bus_arg, "--noverify")
+        self._standby_argv = (self.ddcutil, "setvcp", "D6", "02", bus_arg, "--noverify")
+
+        # Likewise the raw DDC/CI packets (including checksums) for the i2c path
+        self._packets = {
+            name: self.ddc_set_vcp_packet(self.VCP_INPUT_SOURCE, vcp_code)
+            for name, vcp_code in self.inputs.items()
+        }
+        self._wake_packet = self.ddc_set_vcp_packet(self.VCP_POWER_MODE, self.POWER_ON)
+        self._standby_packet = self.ddc_set_vcp_packet(
+            self.VCP_POWER_MODE, self.POWER_STANDBY
+        )
+        self._get_input_packet = self.ddc_packet(0x01, self.VCP_INPUT_SOURCE)
+
+        # Resolve each button straight to its (name, coroutine) pair, so a
+        # press is a single lookup
+        actions = {
+            "displayport": self.switch_to_computer_a,
+            "usbc": self.switch_to_computer_b,
+            "hdmi_standby": self.switch_to_hdmi_and_standby,
+        }
+        self._dispatch = {}
+        for scancode, name in self.button_mapping.items():
+            if name in actions:
+                self._dispatch[scancode] = (name, actions[name])
+            else:
+                logger.error("Unknown action %s for scancode %d", name, scancode)
+
+        # Write VCP values straight to the bus, keeping it open for the
+        # lifetime of the daemon; None means fall back to ddcutil
+        self._i2c_fd = self.open_i2c_bus()
 
         # USB Switch GPIO Configuration - CHANGED PINS
         self.USB_SWITCH_INPUT_1_GPIO = (
@@ -55,7 +143,16 @@ class DDCMonitorSwitcher:
         self.SWITCH_PULSE_DURATION = 0.1  # Hold optocoupler active for 100ms
         self.usb_switch_enabled = True
 
+        # ddcutil can hang the i2c bus if invoked in quick succession, so
+        # rapid presses are coalesced and only the latest action is run
+        self.DEBOUNCE_DELAY = 0.15  # Wait 150ms for further presses
+        self._pending = None
+        self._worker_task = None
+
         self.device = None
+        self.udev_monitor = None
+        self._reader_task = None
+        self._stop = None  # Set to end run() after an unrecoverable error
         self.current_input = None
         self.gpio_initialized = False
 
@@ -69,10 +166,10 @@ class DDCMonitorSwitcher:
 
     def signal_handler(self, sig, frame):
         """Handle program termination signals"""
-        logging.info("Program terminating, cleaning up...")
+        logger.info("Program terminating, cleaning up...")
         self.cleanup_usb_switch_gpio()
         if self.device:
-            self.device.close()
+            self.release_device()
         sys.exit(0)
 
     def setup_usb_switch_gpio(self):
@@ -83,9 +180,9 @@ class DDCMonitorSwitcher:
             GPIO.setup(self.USB_SWITCH_INPUT_2_GPIO, GPIO.OUT, initial=GPIO.LOW)
             self.gpio_initialized = True
             self.usb_switch_enabled = True
-            logging.info("USB switch GPIO pins initialized successfully")
+            logger.info("USB switch GPIO pins initialized successfully")
         except Exception as e:
-            logging.error(f"Failed to initialize USB switch GPIO: {e}")
+            logger.error(f"Failed to initialize USB switch GPIO: {e}")
             self.usb_switch_enabled = False
             self.gpio_initialized = False
 
@@ -98,388 +195,646 @@ class DDCMonitorSwitcher:
                 GPIO.cleanup(
                     [self.USB_SWITCH_INPUT_1_GPIO, self.USB_SWITCH_INPUT_2_GPIO]
                 )
-                logging.info("USB switch GPIO cleaned up")
+                logger.info("USB switch GPIO cleaned up")
                 self.gpio_initialized = False
             except Exception as e:
-                logging.error(f"Error cleaning up USB switch GPIO: {e}")
+                logger.error(f"Error cleaning up USB switch GPIO: {e}")
 
-    def switch_usb_to_input_1(self):
+    async def switch_usb_to_input_1(self):
         """Switch USB to Input 1 (Computer A)"""
         if not self.usb_switch_enabled:
-            logging.warning("USB switch disabled, skipping USB Input 1 switch")
+            logger.warning("USB switch disabled, skipping USB Input 1 switch")
             return False
 
         try:
-            logging.info("Switching USB to Input 1 (Computer A)")
+            logger.info("Switching USB to Input 1 (Computer A)")
             GPIO.output(self.USB_SWITCH_INPUT_1_GPIO, GPIO.HIGH)  # Activate optocoupler
-            time.sleep(self.SWITCH_PULSE_DURATION)  # Hold for 100ms
+            await asyncio.sleep(self.SWITCH_PULSE_DURATION)  # Hold for 100ms
             GPIO.output(
                 self.USB_SWITCH_INPUT_1_GPIO, GPIO.LOW
             )  # Deactivate optocoupler
-            logging.info("USB switched to Input 1 (Computer A)")
+            logger.info("USB switched to Input 1 (Computer A)")
             return True
         except Exception as e:
-            logging.error(f"Error switching USB to Input 1: {e}")
+            logger.error(f"Error switching USB to Input 1: {e}")
             return False
 
-    def switch_usb_to_input_2(self):
+    async def switch_usb_to_input_2(self):
         """Switch USB to Input 2 (Computer B)"""
         if not self.usb_switch_enabled:
-            logging.warning("USB switch disabled, skipping USB Input 2 switch")
+            logger.warning("USB switch disabled, skipping USB Input 2 switch")
             return False
 
         try:
-            logging.info("Switching USB to Input 2 (Computer B)")
+            logger.info("Switching USB to Input 2 (Computer B)")
             GPIO.output(self.USB_SWITCH_INPUT_2_GPIO, GPIO.HIGH)  # Activate optocoupler
-            time.sleep(self.SWITCH_PULSE_DURATION)  # Hold for 100ms
+            await asyncio.sleep(self.SWITCH_PULSE_DURATION)  # Hold for 100ms
             GPIO.output(
                 self.USB_SWITCH_INPUT_2_GPIO, GPIO.LOW
             )  # Deactivate optocoupler
-            logging.info("USB switched to Input 2 (Computer B)")
+            logger.info("USB switched to Input 2 (Computer B)")
             return True
         except Exception as e:
-            logging.error(f"Error switching USB to Input 2: {e}")
+            logger.error(f"Error switching USB to Input 2: {e}")
             return False
 
-    def switch_to_computer_a(self):
+    async def switch_to_computer_a(self):
         """
         Switch both DDC (monitor) and USB to Computer A
         Computer A uses DisplayPort input and USB Input 1
         """
-        logging.info("Switching to Computer A (DisplayPort + USB Input 1)...")
-
-        # Switch monitor to DisplayPort
-        ddc_success = self.wake_and_switch("displayport")
+        logger.info("Switching to Computer A (DisplayPort + USB Input 1)...")
 
-        # Switch USB to Input 1
-        usb_success = self.switch_usb_to_input_1()
+        # Switch monitor to DisplayPort and USB to Input 1; the monitor is on
+        # i2c and the USB switch on GPIO, so both can proceed at once
+        ddc_success, usb_success = await asyncio.gather(
+            self.wake_and_switch("displayport"), self.switch_usb_to_input_1()
+        )
 
         success = ddc_success and (usb_success or not self.usb_switch_enabled)
 
         if success:
-            logging.info("Successfully switched to Computer A")
+            logger.info("Successfully switched to Computer A")
         else:
-            logging.error("Failed to completely switch to Computer A")
+            logger.error("Failed to completely switch to Computer A")
 
         return success
 
-    def switch_to_computer_b(self):
+    async def switch_to_computer_b(self):
         """
         Switch both DDC (monitor) and USB to Computer B
         Computer B uses USB-C input and USB Input 2
         """
-        logging.info("Switching to Computer B (USB-C + USB Input 2)...")
+        logger.info("Switching to Computer B (USB-C + USB Input 2)...")
 
-        # Switch monitor to USB-C
-        ddc_success = self.wake_and_switch("usbc")
-
-        # Switch USB to Input 2
-        usb_success = self.switch_usb_to_input_2()
+        # Switch monitor to USB-C and USB to Input 2 concurrently
+        ddc_success, usb_success = await asyncio.gather(
+            self.wake_and_switch("usbc"), self.switch_usb_to_input_2()
+        )
 
         success = ddc_success and (usb_success or not self.usb_switch_enabled)
 
         if success:
-            logging.info("Successfully switched to Computer B")
+            logger.info("Successfully switched to Computer B")
         else:
-            logging.error("Failed to completely switch to Computer B")
+            logger.error("Failed to completely switch to Computer B")
 
         return success
 
-    def test_usb_switch(self):
+    async def test_usb_switch(self):
         """Test USB switch functionality"""
         if not self.usb_switch_enabled:
-            logging.warning("USB switch disabled, cannot test")
+            logger.warning("USB switch disabled, cannot test")
             return False
 
-        logging.info("Testing USB switch...")
+        logger.info("Testing USB switch...")
 
-        logging.info("Testing USB Input 1...")
-        if self.switch_usb_to_input_1():
-            time.sleep(2)  # Wait 2 seconds
-            logging.info("USB Input 1 test completed")
+        logger.info("Testing USB Input 1...")
+        if await self.switch_usb_to_input_1():
+            await asyncio.sleep(2)  # Wait 2 seconds
+            logger.info("USB Input 1 test completed")
 
-        logging.info("Testing USB Input 2...")
-        if self.switch_usb_to_input_2():
-            time.sleep(2)  # Wait 2 seconds
-            logging.info("USB Input 2 test completed")
+        logger.info("Testing USB Input 2...")
+        if await self.switch_usb_to_input_2():
+            await asyncio.sleep(2)  # Wait 2 seconds
+            logger.info("USB Input 2 test completed")
 
-        logging.info("USB switch test completed")
+        logger.info("USB switch test completed")
         return True
 
     def debug_gpio_state(self):
         """Debug function to check GPIO pin states"""
         if not self.gpio_initialized:
-            logging.warning("GPIO not initialized, cannot check states")
+            logger.warning("GPIO not initialized, cannot check states")
             return
 
         try:
             # Note: Reading output pin states may not work on all Pi models
-            logging.info(f"USB Switch GPIO Configuration:")
-            logging.info(f"  Input 1 GPIO: {self.USB_SWITCH_INPUT_1_GPIO}")
-            logging.info(f"  Input 2 GPIO: {self.USB_SWITCH_INPUT_2_GPIO}")
-            logging.info(f"  Pulse Duration: {self.SWITCH_PULSE_DURATION}s")
-            logging.info(f"  USB Switch Enabled: {self.usb_switch_enabled}")
+            logger.info(f"USB Switch GPIO Configuration:")
+            logger.info(f"  Input 1 GPIO: {self.USB_SWITCH_INPUT_1_GPIO}")
+            logger.info(f"  Input 2 GPIO: {self.USB_SWITCH_INPUT_2_GPIO}")
+            logger.info(f"  Pulse Duration: {self.SWITCH_PULSE_DURATION}s")
+            logger.info(f"  USB Switch Enabled: {self.usb_switch_enabled}")
         except Exception as e:
-            logging.error(f"Error reading GPIO debug info: {e}")
+            logger.error(f"Error reading GPIO debug info: {e}")
 
     def find_macro_pad(self):
         """Find and connect to the macro pad device"""
-        devices = [evdev.InputDevice(path) for path in evdev.list_devices()]
-
-        for device in devices:
+        # Single pass: probe each device's capabilities once and close
+        # anything that is not keyboard-like straight away
+        keyboard_devices = []
+        for path in evdev.list_devices():
+            device = evdev.InputDevice(path)
             # Look for keyboard-like devices (macro pads usually appear as keyboards)
-            if evdev.ecodes.EV_KEY in device.capabilities():
-                logging.info(f"Found input device: {device.name} at {device.path}")
-                # Look for the specific binepad BNK8 device (not the "Keyboard" variant)
-                if device.name == "binepad BNK8":
-                    return device
+            if EV_KEY not in device.capabilities():
+                device.close()
+                continue
+
+            logger.info(f"Found input device: {device.name} at {device.path}")
+            # Look for the specific binepad BNK8 device (not the "Keyboard" variant)
+            if device.name == "binepad BNK8":
+                for other in keyboard_devices:
+                    other.close()
+                self.grab_device(device)
+                return device
+            keyboard_devices.append(device)
 
         # If no specific macro pad found, list all keyboard devices for manual selection
-        keyboard_devices = []
-        for device in devices:
-            if evdev.ecodes.EV_KEY in device.capabilities():
-                keyboard_devices.append(device)
-
         if keyboard_devices:
-            logging.info("Available keyboard-like devices:")
+            logger.info("Available keyboard-like devices:")
             for i, dev in enumerate(keyboard_devices):
-                logging.info(f"  {i}: {dev.name} at {dev.path}")
+                logger.info(f"  {i}: {dev.name} at {dev.path}")
 
             # For now, return the first one (you can modify this logic)
-            return keyboard_devices[0] if keyboard_devices else None
+            for dev in keyboard_devices[1:]:
+                dev.close()
+            return keyboard_devices[0]
 
         return None
 
-    def wake_monitor(self):
-        """Wake up the monitor from standby/sleep"""
-        cmd = [
-            "ddcutil",
-            "setvcp",
-            "D6",
-            "01",  # Set power state to On
-            f"--bus={self.bus_number}",
-            "--noverify",
-        ]
+    def grab_device(self, device):
+        """Take exclusive access so macro pad keys only reach this daemon"""
+        try:
+            device.grab()
+            logger.info("Grabbed exclusive access to %s", device.name)
+        except OSError as e:
+            logger.warning("Could not grab %s, continuing shared: %s", device.name, e)
 
+    def release_device(self):
+        """Release exclusive access (if held) and close the input device"""
+        try:
+            self.device.ungrab()
+        except OSError:
+            pass  # Not grabbed, or the device is already gone
+        self.device.close()
+
+    def open_i2c_bus(self):
+        """Open the monitor's i2c bus for direct DDC/CI writes"""
+        path = f"/dev/i2c-{self.bus_number}"
         try:
-            logging.info("Sending wake command to monitor")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+            fd = os.open(path, os.O_RDWR)
+        except OSError as e:
+            logger.warning("Cannot open %s (%s), using ddcutil instead", path, e)
+            return None
+        try:
+            fcntl.ioctl(fd, self.I2C_SLAVE, self.DDC_CI_ADDRESS)
+        except OSError as e:
+            logger.warning("Cannot address monitor on %s (%s), using ddcutil", path, e)
+            os.close(fd)
+            return None
+        logger.info("Sending DDC/CI commands directly on %s", path)
+        return fd
+
+    def close_i2c_bus(self):
+        """Close the i2c bus if it was opened"""
+        if self._i2c_fd is not None:
+            os.close(self._i2c_fd)
+            self._i2c_fd = None
+
+    @staticmethod
+    def ddc_packet(*payload):
+        """Build a DDC/CI message from the host, appending its checksum"""
+        packet = bytes([0x51, 0x80 | len(payload), *payload])
+        # The checksum covers the destination address (0x6E) as well
+        checksum = DDCMonitorSwitcher.DDC_CI_ADDRESS << 1
+        for byte in packet:
+            checksum ^= byte
+        return packet + bytes([checksum])
+
+    @staticmethod
+    def ddc_set_vcp_packet(feature, value):
+        """Build a DDC/CI Set VCP Feature message"""
+        return DDCMonitorSwitcher.ddc_packet(0x03, feature, value >> 8, value & 0xFF)
+
+    async def read_vcp(self, packet):
+        """Send a prebuilt Get VCP packet over i2c and return the value
+
+        Returns None if the monitor's reply is malformed or reports an error.
+        """
+        os.write(self._i2c_fd, packet)
+        await asyncio.sleep(self.DDC_CI_REPLY_DELAY)
+        reply = os.read(self._i2c_fd, 11)
+        await asyncio.sleep(self.DDC_CI_DELAY)
+
+        # 6E 88 02 <result> <feature> <type> <max hi> <max lo> <hi> <lo> <chk>,
+        # with the checksum seeded from the host's 0x50 address
+        checksum = 0x50
+        for byte in reply[:-1]:
+            checksum ^= byte
+        if (
+            len(reply) != 11
+            or reply[2] != 0x02
+            or reply[3] != 0x00
+            or reply[4] != packet[3]
+            or reply[10] != checksum
+        ):
+            return None
+        return (reply[8] << 8) | reply[9]
+
+    async def set_vcp(self, packet, argv, readback=None):
+        """Send a prebuilt Set VCP packet over i2c, or run argv with ddcutil
+
+        Returns 0 on success, like a ddcutil return code. An acknowledged
+        write is not proof the monitor applied it (one waking from standby
+        may ignore it), so with a readback Get VCP packet the value is read
+        back and the write retried, as ddcutil's setvcp verification does.
+        If the write never sticks, argv is run with ddcutil instead.
+        """
+        if self._i2c_fd is not None:
+            # Back off 50, 100, 200, 400ms after each failed attempt
+            delay = self.DDC_CI_DELAY
+            for _ in range(self.DDC_CI_RETRIES):
+                try:
+                    os.write(self._i2c_fd, packet)
+                    # The monitor ignores messages that arrive too soon after this
+                    await asyncio.sleep(self.DDC_CI_DELAY)
+                    if readback is None:
+                        return 0
+                    # Input source and similar features only use the low byte
+                    value = await self.read_vcp(readback)
+                    if value is not None and (value & 0xFF) == packet[5]:
+                        return 0
+                    error = f"read back {value} instead of {packet[5]}"
+                except OSError as e:
+                    error = e
+                await asyncio.sleep(delay)
+                delay *= 2
+            logger.warning("i2c set VCP failed (%s), retrying with ddcutil", error)
+
+        # Output is only looked at when debugging, so skip the pipes. A monitor
+        # still coming out of standby gets ddcutil's own, longer retry budget.
+        returncode, _, _ = await self.run_ddcutil(
+            argv, capture=logger.isEnabledFor(logging.DEBUG)
+        )
+        return returncode
+
+    async def run_ddcutil(self, cmd, timeout=10, capture=True):
+        """Run a ddcutil command without blocking the event loop
 
-            if result.returncode == 0:
-                logging.info("Wake command sent successfully")
+        Returns (returncode, stdout, stderr); the output is None when
+        capture is False. Raises asyncio.TimeoutError after killing the
+        process if it does not finish in time; the process is also killed
+        if the calling task is cancelled.
+        """
+        output = asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL
+        # close_fds=False (all our fds are non-inheritable anyway) plus an
+        # absolute ddcutil path lets subprocess use posix_spawn over fork
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=output, stderr=output, close_fds=False
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except BaseException:
+            # Timed out or cancelled - don't leave ddcutil running on the bus
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s -> rc=%d stdout=%r stderr=%r",
+                " ".join(cmd),
+                proc.returncode,
+                stdout,
+                stderr,
+            )
+        return proc.returncode, stdout, stderr
+
+    async def wake_monitor(self):
+        """Wake up the monitor from standby/sleep"""
+        try:
+            returncode = await self.set_vcp(self._wake_packet, self._wake_argv)
+
+            if returncode == 0:
+                logger.info("wake rc=%d", returncode)
                 return True
             else:
-                logging.warning(f"Wake command failed with code {result.returncode}")
+                logger.warning("Wake command failed with code %d", returncode)
                 return False
 
-        except subprocess.TimeoutExpired:
-            logging.error("Wake command timed out")
+        except asyncio.TimeoutError:
+            logger.error("Wake command timed out")
             return False
         except Exception as e:
-            logging.error(f"Error sending wake command: {e}")
+            logger.error("Error sending wake command: %s", e)
             return False
 
-    def switch_input(self, input_name):
+    async def switch_input(self, input_name):
         """Switch monitor input using DDC command"""
         if input_name not in self.inputs:
-            logging.error(f"Unknown input: {input_name}")
+            logger.error("Unknown input: %s", input_name)
             return False
 
-        vcp_code = self.inputs[input_name]
-        cmd = ["ddcutil", "setvcp", "60", str(vcp_code), f"--bus={self.bus_number}"]
-
         try:
-            logging.info(f"Switching to {input_name} (VCP code: {vcp_code})")
-
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+            returncode = await self.set_vcp(
+                self._packets[input_name],
+                self._argv[input_name],
+                readback=self._get_input_packet,
+            )
 
-            if result.returncode == 0:
-                logging.info(f"Successfully switched to {input_name}")
+            if returncode == 0:
+                logger.info(
+                    "switch %s vcp=%d rc=%d",
+                    input_name,
+                    self.inputs[input_name],
+                    returncode,
+                )
                 self.current_input = input_name
+                if self.verify:
+                    return await self.verify_input(input_name)
                 return True
             else:
-                logging.error(f"Input switch failed with code {result.returncode}")
+                logger.error("Input switch failed with code %d", returncode)
+                self.current_input = None  # Unknown until queried again
                 return False
 
-        except subprocess.TimeoutExpired:
-            logging.error("Input switch command timed out")
+        except asyncio.TimeoutError:
+            logger.error("Input switch command timed out")
+            self.current_input = None
             return False
         except Exception as e:
-            logging.error(f"Error executing input switch: {e}")
+            logger.error("Error executing input switch: %s", e)
+            self.current_input = None
             return False
 
-    def get_current_input(self):
-        """Get current monitor input (optional - for status checking)"""
-        cmd = ["ddcutil", "getvcp", "60", f"--bus={self.bus_number}"]
+    async def verify_input(self, input_name):
+        """Read the input back from the monitor to confirm a switch"""
+        await asyncio.sleep(self.VERIFY_DELAY)
+        actual_input = await self.get_current_input()
+        if actual_input == input_name:
+            return True
+
+        logger.warning(
+            "Switched to %s but monitor reports %s", input_name, actual_input
+        )
+        self.current_input = actual_input
+        return False
 
+    async def get_current_input(self):
+        """Get current monitor input (optional - for status checking)"""
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
+            returncode, stdout, _ = await self.run_ddcutil(self._get_argv, timeout=5)
+            if returncode == 0:
                 # Parse the output to determine current input
-                output = result.stdout.lower()
-                if "x0f" in output or "15" in output:
-                    return "displayport"
-                elif "x1b" in output or "27" in output:
-                    return "usbc"
-                elif "x11" in output or "17" in output:
-                    return "hdmi"
+                match = self._CUR_RE.search(stdout)
+                if match:
+                    hex_value = match.group(1) or match.group(2)
+                    code = int(hex_value, 16) if hex_value else int(match.group(3))
+                    return self._vcp_to_name.get(code, "unknown")
             return "unknown"
-        except:
+        except Exception:
             return "unknown"
 
-    def wake_and_switch(self, input_name):
+    async def wake_and_switch(self, input_name):
         """Wake monitor and switch input - simple approach"""
-        logging.info(f"Wake and switch to {input_name} requested")
-
-        # Step 1: Always send wake command (safe even if already awake)
-        self.wake_monitor()
+        # Step 1: Send wake command (safe even if already awake)
+        if self.wake_before:
+            await self.wake_monitor()
 
         # Step 2: Switch to requested input
-        return self.switch_input(input_name)
+        return await self.switch_input(input_name)
 
-    def switch_to_hdmi_and_standby(self):
+    async def switch_to_hdmi_and_standby(self):
         """Switch to HDMI input and then activate standby mode (no USB change)"""
-        logging.info("Starting HDMI + Standby sequence")
-
-        # Step 1: Switch to HDMI input
-        hdmi_cmd = ["ddcutil", "setvcp", "60", "17", f"--bus={self.bus_number}"]
-
         try:
-            logging.info("Step 1: Switching to HDMI input")
-            hdmi_result = subprocess.run(
-                hdmi_cmd, capture_output=True, text=True, timeout=10
+            # Step 1: Switch to HDMI input
+            hdmi_returncode = await self.set_vcp(
+                self._packets["hdmi"],
+                self._argv["hdmi"],
+                readback=self._get_input_packet,
             )
 
-            if hdmi_result.returncode != 0:
-                logging.error(f"HDMI switch failed with code {hdmi_result.returncode}")
+            if hdmi_returncode != 0:
+                logger.error("HDMI switch failed with code %d", hdmi_returncode)
+                self.current_input = None  # Unknown until queried again
                 return False
 
-            logging.info("HDMI switch completed successfully")
             self.current_input = "hdmi"
 
             # Step 2: Activate standby mode
-            standby_cmd = [
-                "ddcutil",
-                "setvcp",
-                "D6",
-                "02",
-                f"--bus={self.bus_number}",
-                "--noverify",
-            ]
-
-            logging.info("Step 2: Activating standby mode")
-            standby_result = subprocess.run(
-                standby_cmd, capture_output=True, text=True, timeout=10
+            standby_returncode = await self.set_vcp(
+                self._standby_packet, self._standby_argv
             )
 
-            if standby_result.returncode == 0:
-                logging.info("HDMI + Standby sequence completed successfully")
+            if standby_returncode == 0:
+                logger.info("hdmi+standby rc=%d", standby_returncode)
                 return True
             else:
-                logging.error(
-                    f"Standby command failed with code {standby_result.returncode}"
-                )
+                logger.error("Standby command failed with code %d", standby_returncode)
                 return False
 
-        except subprocess.TimeoutExpired:
-            logging.error("HDMI + Standby command timed out")
+        except asyncio.TimeoutError:
+            logger.error("HDMI + Standby command timed out")
+            self.current_input = None
             return False
         except Exception as e:
-            logging.error(f"Error in HDMI + Standby sequence: {e}")
+            logger.error("Error in HDMI + Standby sequence: %s", e)
+            self.current_input = None
             return False
 
-    def handle_button_press(self, key_event):
+    def handle_button_press(self, scancode, name, action):
         """Handle macro pad button press"""
-        # Get both the numeric scancode and string keycode
-        scancode = key_event.scancode
-        keycode_str = key_event.keycode
+        logger.info("press %d -> %s", scancode, name)
 
-        logging.info(
-            f"Button press detected - scancode: {scancode}, keycode: {keycode_str}"
-        )
+        # Queue the action; any earlier press not yet started is dropped
+        self._pending = action
+        if self._worker_task is None:
+            self._worker_task = asyncio.create_task(self._drain())
 
-        # Check if the scancode matches our mapping
-        if scancode in self.button_mapping:
-            action = self.button_mapping[scancode]
-            logging.info(f"Button mapped to: {action}")
-
-            # Handle different button actions
-            if action == "displayport":
-                # F23: Switch to Computer A (DisplayPort + USB Input 1)
-                logging.info("Executing switch to Computer A")
-                self.switch_to_computer_a()
-            elif action == "usbc":
-                # F24: Switch to Computer B (USB-C + USB Input 2)
-                logging.info("Executing switch to Computer B")
-                self.switch_to_computer_b()
-            elif action == "hdmi_standby":
-                # F22: HDMI + Standby (no USB change)
-                logging.info("Executing HDMI + Standby sequence")
-                self.switch_to_hdmi_and_standby()
-        else:
-            logging.info(f"Scancode {scancode} not found in button mapping")
-            logging.info(f"Available mappings: {self.button_mapping}")
+    async def _drain(self):
+        """Run queued button actions one at a time, keeping only the latest"""
+        try:
+            while self._pending is not None:
+                await asyncio.sleep(self.DEBOUNCE_DELAY)
+                action = self._pending
+                self._pending = None
+                await action()
+        finally:
+            self._worker_task = None
 
-    def run(self):
+    async def run(self):
         """Main event loop"""
-        logging.info("Starting DDC Monitor Switcher with USB Switch Control...")
-        logging.info("Mode: Always wake + switch for F23/F24 with USB switching")
+        logger.info("Starting DDC Monitor Switcher with USB Switch Control...")
+        logger.info(
+            "Mode: wake before switch %s, verify %s, with USB switching",
+            "on" if self.wake_before else "off",
+            "on" if self.verify else "off",
+        )
+        logger.info("Using ddcutil at %s", self.ddcutil)
 
         # Log USB switch status
         if self.usb_switch_enabled:
-            logging.info(
+            logger.info(
                 f"USB switch enabled - GPIO {self.USB_SWITCH_INPUT_1_GPIO} (Input 1), GPIO {self.USB_SWITCH_INPUT_2_GPIO} (Input 2)"
             )
             self.debug_gpio_state()
         else:
-            logging.warning("USB switch disabled due to GPIO initialization failure")
-
-        # Find macro pad
-        self.device = self.find_macro_pad()
-        if not self.device:
-            logging.error("No suitable input device found!")
-            return
-
-        logging.info(f"Using device: {self.device.name}")
+            logger.warning("USB switch disabled due to GPIO initialization failure")
 
         # Get initial input state
-        self.current_input = self.get_current_input()
-        logging.info(f"Current monitor input: {self.current_input}")
+        self.current_input = await self.get_current_input()
+        logger.info(f"Current monitor input: {self.current_input}")
 
         # Button mapping summary
-        logging.info("Button mappings:")
-        logging.info("  F23 (Button 1): Computer A (DisplayPort + USB Input 1)")
-        logging.info("  F24 (Button 2): Computer B (USB-C + USB Input 2)")
-        logging.info("  F22 (Button 3): HDMI + Standby (no USB change)")
+        logger.info("Button mappings:")
+        logger.info("  F23 (Button 1): Computer A (DisplayPort + USB Input 1)")
+        logger.info("  F24 (Button 2): Computer B (USB-C + USB Input 2)")
+        logger.info("  F22 (Button 3): HDMI + Standby (no USB change)")
+
+        # Watch for input devices being plugged in or removed. Started before
+        # the device scan so a pad plugged in meanwhile is not missed.
+        self.udev_monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        self.udev_monitor.filter_by("input")
+        self.udev_monitor.start()
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.udev_monitor.fileno(), self.on_udev_event)
+        self._stop = asyncio.Event()
+
+        # Find macro pad
+        device = self.find_macro_pad()
+        if device:
+            self.attach_device(device)
+        else:
+            logger.warning("No suitable input device found, waiting for hotplug...")
 
         try:
-            # Main event loop
-            for event in self.device.read_loop():
-                if event.type == evdev.ecodes.EV_KEY:
-                    key_event = evdev.categorize(event)
-
-                    # Only handle key press events (not release)
-                    if key_event.keystate == evdev.KeyEvent.key_down:
-                        logging.info(f"Key press: {key_event.keycode}")
-                        self.handle_button_press(key_event)
-
-        except KeyboardInterrupt:
-            logging.info("Shutting down...")
-        except Exception as e:
-            logging.error(f"Error in main loop: {e}")
+            # Everything else happens in callbacks and tasks; idle until
+            # the process is signalled to stop or a read fails for good
+            await self._stop.wait()
         finally:
+            loop.remove_reader(self.udev_monitor.fileno())
             if self.device:
-                self.device.close()
+                self.detach_device()
+            self.close_i2c_bus()
             self.cleanup_usb_switch_gpio()
 
+    def attach_device(self, device):
+        """Start reading button presses from an input device"""
+        self.device = device
+        logger.info("Using device: %s", device.name)
+        self._reader_task = asyncio.create_task(self.read_events(device))
+
+    def detach_device(self):
+        """Stop reading from the current input device and release it"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self.release_device()
+        self.device = None
+
+    def on_udev_event(self):
+        """Attach or detach the macro pad when udev reports a hotplug"""
+        udev_device = self.udev_monitor.poll(timeout=0)
+        if udev_device is None:
+            return
+        node = udev_device.device_node
+        if not node or not node.startswith("/dev/input/event"):
+            return
+
+        # A fallback keyboard picked at startup is only a stand-in, so a
+        # BNK8 showing up later still takes its place
+        if udev_device.action == "add" and (
+            self.device is None or self.device.name != "binepad BNK8"
+        ):
+            try:
+                device = evdev.InputDevice(node)
+            except OSError as e:
+                logger.warning("Could not open %s: %s", node, e)
+                return
+            if device.name != "binepad BNK8":
+                device.close()
+                return
+            logger.info("Macro pad connected at %s", node)
+            if self.device is not None:
+                logger.info("Replacing fallback device %s", self.device.name)
+                self.detach_device()
+            self.grab_device(device)
+            self.attach_device(device)
+        elif (
+            udev_device.action == "remove"
+            and self.device is not None
+            and self.device.path == node
+        ):
+            logger.info("Macro pad at %s removed", node)
+            self.detach_device()
+
+    async def read_events(self, device):
+        """Read key events from the device and dispatch mapped presses"""
+        # Hoist lookups out of the per-event path
+        dispatch_get = self._dispatch.get
+        handler = self.handle_button_press
+        KEY = EV_KEY
+        DOWN = KEY_DOWN
+
+        try:
+            # Main event loop - the device fd is watched by the asyncio
+            # selector, so presses are read as soon as a DDC command yields
+            async for event in device.async_read_loop():
+                # Only handle key press events (not release or repeat)
+                if event.type != KEY or event.value != DOWN:
+                    continue
+                # Ignore keys we have no action for; no categorize() needed
+                entry = dispatch_get(event.code)
+                if entry is None:
+                    continue
+                handler(event.code, *entry)
+
+        except Exception as e:
+            if not (isinstance(e, OSError) and e.errno == errno.ENODEV):
+                logger.error("Error in main loop: %s", e)
+                # No udev "add" will come for a pad that is still plugged in,
+                # so end run() and let systemd restart the service
+                self._stop.set()
+                return
+            logger.warning("Lost input device %s: %s", device.path, e)
+
+        # Unplugged: drop the device so a udev "add" can attach it again
+        if self.device is device:
+            self._reader_task = None
+            self.detach_device()
+
+
+def set_realtime_priority():
+    """Pin to one CPU and run under SCHED_FIFO for steady press latency
+
+    SCHED_RESET_ON_FORK keeps the ddcutil children at normal priority.
+    Silently skipped when not permitted (e.g. not running as root).
+    """
+    try:
+        os.sched_setaffinity(0, {0})
+        os.sched_setscheduler(
+            0, os.SCHED_FIFO | os.SCHED_RESET_ON_FORK, os.sched_param(10)
+        )
+        logger.info("Running with SCHED_FIFO priority 10 on CPU 0")
+    except (AttributeError, OSError) as e:
+        logger.debug("Real-time scheduling unavailable: %s", e)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="DDC monitor input switcher")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="read the input back from the monitor after each switch",
+    )
+    parser.add_argument(
+        "--no-wake-before-switch",
+        dest="wake_before_switch",
+        action="store_false",
+        help="don't send a wake command before switching inputs",
+    )
+    args = parser.parse_args()
+
     # Check if running as root (needed for DDC commands and GPIO)
     if Path("/var/log").exists() and not Path("/var/log").is_dir():
-        logging.error("Cannot access log directory")
+        logger.error("Cannot access log directory")
+
+    set_realtime_priority()
 
-    switcher = DDCMonitorSwitcher()
-    switcher.run()
+    switcher = DDCMonitorSwitcher(
+        verify=args.verify, wake_before=args.wake_before_switch
+    )
+    asyncio.run(switcher.run())
 
 
 if __name__ == "__main__":